@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 # Genesis - A toolkit for working with phylogenetic data.
 # Copyright (C) 2014-2017 Lucas Czech
@@ -21,12 +21,8 @@
 # Exelixis Lab, Heidelberg Institute for Theoretical Studies
 # Schloss-Wolfsbrunnenweg 35, D-69118 Heidelberg, Germany
 
-import os
-import re
 import sys
 
-import xml.etree.ElementTree
-
 # from py_binder.boost_writer import *
 from py_binder.cpp_entities import *
 from py_binder.doxygen_reader import *
@@ -55,13 +51,13 @@ if __name__ == "__main__":
     if len(sys.argv) == 3:
         src_dir = sys.argv[2].strip("/")
     if len(sys.argv) >  3:
-        print "Usage:", sys.argv[0], "[input_xml_dir=\"./xml\"] [output_src_dir=\"./src\"]"
+        print("Usage:", sys.argv[0], "[input_xml_dir=\"./xml\"] [output_src_dir=\"./src\"]")
         sys.exit()
 
     # Print some user information
-    print "Using input  xml dir:", xml_dir
-    print "Using output src dir:", src_dir
-    print
+    print("Using input  xml dir:", xml_dir)
+    print("Using output src dir:", src_dir)
+    print()
 
     # Read doxygen files into global namespace object
     ns_global = DoxygenReader.parse_xml_dir (xml_dir)
@@ -75,6 +71,6 @@ if __name__ == "__main__":
     # ns_global.dump(detail=3)
 
     # Generate boost files
-    # print BoostPythonWriter.generate (ns_global)
+    # BoostPythonWriter.write (ns_global, sys.stdout)
     Pybind11Writer.generate_files (ns_global, src_dir, "genesis")
-    print "Finished."
+    print("Finished.")
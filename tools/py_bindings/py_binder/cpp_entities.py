@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 # Genesis - A toolkit for working with phylogenetic data.
 # Copyright (C) 2014-2017 Lucas Czech
@@ -21,14 +21,19 @@
 # Exelixis Lab, Heidelberg Institute for Theoretical Studies
 # Schloss-Wolfsbrunnenweg 35, D-69118 Heidelberg, Germany
 
+import bisect
 import os
-import re
+
+from operator import attrgetter
 
 # ==================================================================================================
 #     Class: C++ Parameter
 # ==================================================================================================
 
 class CppParameter:
+    # There are many of those, so we save the per-instance dict.
+    __slots__ = ( "type", "name", "value" )
+
     def __init__ (self):
         self.type  = ""
         self.name  = ""
@@ -37,13 +42,22 @@ class CppParameter:
     def cpp_signature(self):
         if self.value == None:
             self.value = ""
-        return self.type+" "+self.name+("="+self.value if self.value != "" else "")
+        if self.value != "":
+            return "%s %s=%s" % ( self.type, self.name, self.value )
+        return "%s %s" % ( self.type, self.name )
 
 # ==================================================================================================
 #     Class: C++ Function
 # ==================================================================================================
 
 class CppFunction:
+    # There are many of those, so we save the per-instance dict.
+    __slots__ = (
+        "parent", "name", "template_params", "prot", "static", "const", "virtual", "type",
+        "params", "briefdescription", "detaileddescription", "location", "_full_name",
+        "_signature"
+    )
+
     def __init__ (self):
         self.parent  = None
         self.name    = ""
@@ -62,23 +76,41 @@ class CppFunction:
 
         self.location = ""
 
+        # Caches for cpp_full_name() and the full cpp_signature().
+        # Only to be filled once the parent is set.
+        self._full_name = None
+        self._signature = None
+
     def cpp_full_name (self):
-        return self.parent.cpp_full_name() + "::" + self.name
+        if self._full_name is None:
+            self._full_name = "%s::%s" % ( self.parent.cpp_full_name(), self.name )
+        return self._full_name
 
     def cpp_signature (self, full=True):
-        val  = ("static " if self.static else "")
-        val += (self.type + " " if self.type != "" else "")
-        val += (self.parent.cpp_full_name() + "::" if full else "") + self.name
-        val += " (" + ', '.join(x.cpp_signature() for x in self.params) + ")"
-        val += (" const" if self.const else "")
+        # The full signature is used as a key and in the generated docstrings,
+        # so it is requested several times per function.
+        if full and self._signature is not None:
+            return self._signature
+
+        val = "%s%s%s%s (%s)%s" % (
+            "static " if self.static else "",
+            self.type + " " if self.type != "" else "",
+            self.parent.cpp_full_name() + "::" if full else "",
+            self.name,
+            ', '.join([ x.cpp_signature() for x in self.params ]),
+            " const" if self.const else ""
+        )
+
+        if full:
+            self._signature = val
         return val
 
     def dump (self, indent=0, detail=1):
-        print " " * 4 * indent       + "\x1b[34mFunction " + self.name + "\x1b[0m"
+        print(" " * 4 * indent       + "\x1b[34mFunction " + self.name + "\x1b[0m")
 
         if detail >= 1:
-            print " " * 4 * (indent + 1) + "\x1b[90m" + self.location + "\x1b[0m"
-            print " " * 4 * (indent + 1) + "\x1b[90m" + self.cpp_signature() + "\x1b[0m"
+            print(" " * 4 * (indent + 1) + "\x1b[90m" + self.location + "\x1b[0m")
+            print(" " * 4 * (indent + 1) + "\x1b[90m" + self.cpp_signature() + "\x1b[0m")
 
 # ==================================================================================================
 #     Class: C++ Iterator
@@ -94,16 +126,22 @@ class CppIterator:
         self.end    = ""
 
     def dump (self, indent=0, detail=1):
-        print " " * 4 * indent       + "\x1b[34mIterator " + self.name + "\x1b[0m"
+        print(" " * 4 * indent       + "\x1b[34mIterator " + self.name + "\x1b[0m")
 
         if detail >= 1:
-            print " " * 4 * (indent + 1) + "\x1b[90m["+self.begin+",",self.end+")\x1b[0m"
+            print(" " * 4 * (indent + 1) + "\x1b[90m["+self.begin+",",self.end+")\x1b[0m")
 
 # ==================================================================================================
 #     Class: C++ Class
 # ==================================================================================================
 
 class CppClass:
+    # Also save the per-instance dict of classes, see CppFunction.
+    __slots__ = (
+        "parent", "name", "template_params", "ctors", "dtors", "methods", "operators",
+        "iterators", "briefdescription", "detaileddescription", "location", "_full_name"
+    )
+
     def __init__ (self, name):
         self.parent = None
         self.name   = name
@@ -121,8 +159,13 @@ class CppClass:
 
         self.location = ""
 
+        # Cache for cpp_full_name(). Only to be filled once the parent is set.
+        self._full_name = None
+
     def cpp_full_name (self):
-        return self.parent.cpp_full_name() + "::" + self.name
+        if self._full_name is None:
+            self._full_name = "%s::%s" % ( self.parent.cpp_full_name(), self.name )
+        return self._full_name
 
     def add_function (self, func):
         if func is None:
@@ -152,38 +195,49 @@ class CppClass:
         named 'begin' and 'end'. If all_named==True, all methods starting with '[Bb]egin...'
         and '[Ee]nd...' are extracted as iterators."""
 
-        # process default iterators
+        # the list keeps the order of the methods (and hence of the resulting iterators),
+        # the set is for fast lookups. all extracted functions are removed in one pass at the end.
         method_names = [func.name for func in self.methods]
-        if "begin" in method_names and "end" in method_names:
-            self.add_iterator()
-            self.methods[:] = [f for f in self.methods if f.name not in [ "begin", "end" ]]
+        method_set   = set(method_names)
+        to_remove    = set()
 
-        # continue only if we want to extract all named iterators
-        if not all_named:
-            return
-
-        # process all iterators starting with "[Bb]egin..." and "[Ee]nd..."
-        extracted_iters = []
-        for mn in method_names:
-            if not mn.lower().startswith("begin") or mn == "begin":
-                continue
+        # process default iterators
+        if "begin" in method_set and "end" in method_set:
+            self.add_iterator()
+            to_remove.update([ "begin", "end" ])
+
+        # process all iterators starting with "[Bb]egin..." and "[Ee]nd...",
+        # but only if we want to extract all named iterators
+        if all_named:
+            extracted_iters = set()
+            for mn in method_names:
+                if not mn.lower().startswith("begin") or mn == "begin":
+                    continue
 
-            it_name    = mn[5:].strip('_')
-            begin_name = mn
-            end_name   = re.sub('^begin', 'end', re.sub('^Begin', 'End', mn))
+                it_name    = mn[5:].strip('_')
+                begin_name = mn
+                if mn.startswith("Begin"):
+                    end_name = "End" + mn[5:]
+                elif mn.startswith("begin"):
+                    end_name = "end" + mn[5:]
+                else:
+                    end_name = mn
+
+                # do not extract if no appropriate end function present
+                if end_name not in method_set:
+                    continue
 
-            # do not extract if no appropriate end function present
-            if end_name not in method_names:
-                continue
+                # extract each iterator only once
+                if it_name in extracted_iters:
+                    continue
+                else:
+                    extracted_iters.add(it_name)
 
-            # extract each iterator only once
-            if it_name in extracted_iters:
-                continue
-            else:
-                extracted_iters.append(it_name)
+                self.add_named_iterator(it_name, begin_name, end_name)
+                to_remove.update([ begin_name, end_name ])
 
-            self.add_named_iterator(it_name, begin_name, end_name)
-            self.methods[:] = [f for f in self.methods if f.name not in [ begin_name, end_name ]]
+        if len(to_remove) > 0:
+            self.methods[:] = [f for f in self.methods if f.name not in to_remove]
 
     def shorten_location_prefix (self, prefix = ""):
         if prefix == "":
@@ -191,25 +245,25 @@ class CppClass:
 
         for func in self.ctors:
             if not func.location.startswith(prefix):
-                print "Location of function", func, "does not start with prefix", prefix
+                print("Location of function", func, "does not start with prefix", prefix)
                 continue
             func.location = func.location[len(prefix):]
 
         for func in self.dtors:
             if not func.location.startswith(prefix):
-                print "Location of function", func, "does not start with prefix", prefix
+                print("Location of function", func, "does not start with prefix", prefix)
                 continue
             func.location = func.location[len(prefix):]
 
         for func in self.methods:
             if not func.location.startswith(prefix):
-                print "Location of function", func, "does not start with prefix", prefix
+                print("Location of function", func, "does not start with prefix", prefix)
                 continue
             func.location = func.location[len(prefix):]
 
         for func in self.operators:
             if not func.location.startswith(prefix):
-                print "Location of function", func, "does not start with prefix", prefix
+                print("Location of function", func, "does not start with prefix", prefix)
                 continue
             func.location = func.location[len(prefix):]
 
@@ -218,11 +272,11 @@ class CppClass:
         in_str1 = " " * 4 * (indent + 1)
         in_str2 = " " * 4 * (indent + 2)
 
-        print in_str0 + "\x1b[33mClass", self.name + "\x1b[0m"
+        print(in_str0 + "\x1b[33mClass", self.name + "\x1b[0m")
 
         if detail >= 1:
-            print in_str1 + "\x1b[90m" + self.location + "\x1b[0m"
-            print in_str1 + "\x1b[90m" + self.cpp_full_name() + "\x1b[0m"
+            print(in_str1 + "\x1b[90m" + self.location + "\x1b[0m")
+            print(in_str1 + "\x1b[90m" + self.cpp_full_name() + "\x1b[0m")
 
         if detail < 2:
             return
@@ -232,10 +286,10 @@ class CppClass:
 
         def print_funcs(name, func_set):
             if len(func_set) > 0:
-                print in_str1 + "\x1b[34m"+name+":\x1b[0m"
-                for func in sorted(func_set):
+                print(in_str1 + "\x1b[34m"+name+":\x1b[0m")
+                for func in sorted(func_set, key=attrgetter("name")):
                     if detail == 2:
-                        print in_str2 + "\x1b[34m"+func.name+"\x1b[0m"
+                        print(in_str2 + "\x1b[34m"+func.name+"\x1b[0m")
                     else:
                         func.dump(indent+2, 1)
 
@@ -261,52 +315,69 @@ class CppNamespace:
         self.briefdescription    = ""
         self.detaileddescription = ""
 
+        # Cache for cpp_full_name(). Only to be filled once the parent is set.
+        self._full_name = None
+
+        # Sorted keys of the namespaces and classes dicts, kept in order while adding elements.
+        self._sorted_namespaces = []
+        self._sorted_classes    = []
+
     def cpp_full_name (self):
-        if self.parent is not None:
-            return self.parent.cpp_full_name() + "::" + self.name
-        else:
-            return ""
+        if self._full_name is None:
+            if self.parent is not None:
+                self._full_name = "%s::%s" % ( self.parent.cpp_full_name(), self.name )
+            else:
+                self._full_name = ""
+        return self._full_name
 
     def create_namespace (self, ns):
         if ns is None:
             return
-        if self.namespaces.has_key (ns):
+        if ns in self.namespaces:
             return
         self.namespaces[ns] = CppNamespace(ns)
+        bisect.insort(self._sorted_namespaces, ns)
+
+    def sorted_namespaces (self):
+        """Return the names of the sub-namespaces in sorted order."""
+        return self._sorted_namespaces
 
     def add_class (self, clss):
         if clss is None:
             return
-        if self.classes.has_key (clss.cpp_full_name()):
-            print "Namespace", self.name, "already contains a class named", clss.cpp_full_name()
+        if clss.cpp_full_name() in self.classes:
+            print("Namespace", self.name, "already contains a class named", clss.cpp_full_name())
             return
         self.classes[clss.cpp_full_name()] = clss
+        bisect.insort(self._sorted_classes, clss.cpp_full_name())
+
+    def sorted_classes (self):
+        """Return the (full) names of the classes in sorted order."""
+        return self._sorted_classes
 
     def get_all_classes (self):
-        classlist = []
-        for clss in sorted(self.classes):
-            classlist.append(self.classes[clss])
-        for ns in sorted(self.namespaces):
+        """Yield all classes of this namespace and its sub-namespaces, recursively."""
+        for clss in self.sorted_classes():
+            yield self.classes[clss]
+        for ns in self.sorted_namespaces():
             for clss in self.namespaces[ns].get_all_classes():
-                classlist.append(clss)
-        return classlist
+                yield clss
 
     def add_function (self, func):
         if func is None:
             return
-        if self.functions.has_key (func.cpp_signature()):
-            print "Namespace", self.name, "already contains a function named", func.cpp_signature()
+        if func.cpp_signature() in self.functions:
+            print("Namespace", self.name, "already contains a function named", func.cpp_signature())
             return
         self.functions[func.cpp_signature()] = func
 
     def get_all_functions( self ):
-        funclist = []
+        """Yield all functions of this namespace and its sub-namespaces, recursively."""
         for func in sorted(self.functions):
-            funclist.append(self.functions[func])
-        for ns in sorted(self.namespaces):
+            yield self.functions[func]
+        for ns in self.sorted_namespaces():
             for func in self.namespaces[ns].get_all_functions():
-                funclist.append(func)
-        return funclist
+                yield func
 
     def extract_iterators (self, named = False):
         for clss in self.classes:
@@ -348,19 +419,18 @@ class CppNamespace:
             self.namespaces[ns].extract_ostream_operators()
 
     def get_file_locations (self):
-        locations = []
+        """Yield the file locations of all classes of this namespace and its sub-namespaces."""
         for clss in self.classes:
             if self.classes[clss].location == "":
-                print "Warn: Class without location:", self.classes[clss].name
+                print("Warn: Class without location:", self.classes[clss].name)
             else:
-                locations.append(self.classes[clss].location)
+                yield self.classes[clss].location
         for ns in self.namespaces:
             for loc in self.namespaces[ns].get_file_locations():
-                locations.append(loc)
-        return locations
+                yield loc
 
     def get_location_prefix (self):
-        return os.path.commonprefix(self.get_file_locations())
+        return os.path.commonprefix(list(self.get_file_locations()))
 
     def shorten_location_prefix (self, prefix = ""):
         if prefix == "":
@@ -368,14 +438,14 @@ class CppNamespace:
 
         for clss in self.classes:
             if not self.classes[clss].location.startswith(prefix):
-                print "Location of class", clss, "does not start with prefix", prefix
+                print("Location of class", clss, "does not start with prefix", prefix)
                 continue
             self.classes[clss].location = self.classes[clss].location[len(prefix):]
             self.classes[clss].shorten_location_prefix(prefix)
 
         for func in self.functions:
             if not self.functions[func].location.startswith(prefix):
-                print "Location of function", func, "does not start with prefix", prefix
+                print("Location of function", func, "does not start with prefix", prefix)
                 continue
             self.functions[func].location = self.functions[func].location[len(prefix):]
 
@@ -389,18 +459,10 @@ class CppNamespace:
         1: with path and fully qualified names
         2: with all subfunctions (for classes)"""
 
-        print " " * 4 * indent + "\x1b[31mNamespace " + self.name + "\x1b[0m"
-        for ns in sorted(self.namespaces):
+        print(" " * 4 * indent + "\x1b[31mNamespace " + self.name + "\x1b[0m")
+        for ns in self.sorted_namespaces():
             self.namespaces[ns].dump(indent+1, detail)
-        for clss in sorted(self.classes):
+        for clss in self.sorted_classes():
             self.classes[clss].dump(indent+1, detail)
         for func in sorted(self.functions):
             self.functions[func].dump(indent+1, detail)
-
-# ==================================================================================================
-#     Main
-# ==================================================================================================
-
-if __name__ == "__main__":
-    print "This has no main function."
-    sys.exit()
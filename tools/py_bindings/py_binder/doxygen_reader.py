@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 # Genesis - A toolkit for working with phylogenetic data.
 # Copyright (C) 2014-2017 Lucas Czech
@@ -22,10 +22,194 @@
 # Schloss-Wolfsbrunnenweg 35, D-69118 Heidelberg, Germany
 
 import os
-import re
-import xml.etree.ElementTree
+import sys
 
-from cpp_entities import *
+from operator import attrgetter
+
+# Use lxml if available, as it parses in C and is a lot faster on the large doxygen xml output.
+# Its etree module is API compatible with the standard library ElementTree that we use otherwise,
+# which in turn uses its C implementation where available.
+try:
+    from lxml import etree as ElementTree
+    HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+    HAVE_LXML = False
+
+# Options for the lxml parser: we neither need comments and processing instructions, nor the table
+# of xml ids. Blank text is not removed though, as doxygen uses it in mixed content, e.g., for the
+# space between two refs in a type, which would otherwise get lost.
+LXML_PARSER_OPTIONS = dict( collect_ids=False, remove_comments=True, remove_pis=True )
+
+from .cpp_entities import *
+from .writer_helpers import ParallelMap
+
+# ==================================================================================================
+#     Helper Functions
+# ==================================================================================================
+
+def XmlElementText(elem):
+    """Return the full text content of an xml element, including the text of all its sub-elements
+    (e.g., refs in a type, or paragraphs in a description). Returns an empty string for None.
+    With lxml, the text is concatenated in C, instead of joining the pieces of itertext()."""
+    if elem is None:
+        return ""
+    if HAVE_LXML:
+        return ElementTree.tostring(elem, method="text", encoding="unicode", with_tail=False)
+    return ''.join(elem.itertext())
+
+def XmlIterElements(filename, tag):
+    """Iterate over all elements with the given tag in an xml file, while the file is being parsed.
+    Each element is cleared once the caller is done with it, so that the whole document is never
+    kept in memory at once."""
+    if HAVE_LXML:
+        context = ElementTree.iterparse(filename, events=("end",), tag=tag, **LXML_PARSER_OPTIONS)
+    else:
+        context = ElementTree.iterparse(filename, events=("end",))
+
+    for event, elem in context:
+        if elem.tag != tag:
+            continue
+        yield elem
+        elem.clear()
+
+        # With lxml, we can also remove the (now empty) elements that were already processed
+        # from their parent, so that not even the empty shells pile up in long files.
+        if HAVE_LXML:
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+class XmlMemberTarget:
+    """Parser target for the standard library ElementTree, used by XmlIterMembers() if lxml is not
+    available. Builds the elements of the wanted sections only, and collects a tuple for each
+    completed member and compound. All other sections are dropped while being parsed, before any
+    of their elements is created. With lxml, this is not needed, as it can filter the tags in C,
+    which is a lot faster than calling a Python target for each event."""
+
+    def __init__(self, compound_kinds, section_kinds):
+        self.builder        = ElementTree.TreeBuilder()
+        self.compound_kinds = compound_kinds
+        self.section_kinds  = section_kinds
+        self.items          = []
+        self.compound       = None
+        self.section        = None
+        self.skip           = 0
+
+    def start(self, tag, attrib):
+        if self.skip:
+            self.skip += 1
+            return
+
+        if tag == "sectiondef" and not (
+            self.compound is not None and
+            self.compound.attrib["kind"] in self.compound_kinds and
+            attrib["kind"] in self.section_kinds
+        ):
+            self.skip = 1
+            return
+
+        elem = self.builder.start(tag, attrib)
+        if tag == "compounddef":
+            self.compound = elem
+        elif tag == "sectiondef":
+            self.section  = elem
+
+    def end(self, tag):
+        if self.skip:
+            self.skip -= 1
+            return
+
+        elem = self.builder.end(tag)
+        if tag == "memberdef" and self.section is not None:
+            self.items.append(( self.compound, self.section, elem ))
+        elif tag == "sectiondef":
+            self.section = None
+        elif tag == "compounddef":
+            if self.compound.attrib["kind"] in self.compound_kinds:
+                self.items.append(( self.compound, None, None ))
+            self.compound = None
+
+    def data(self, data):
+        if not self.skip:
+            self.builder.data(data)
+
+    def close(self):
+        return self.builder.close()
+
+def XmlIterMembers(filename, compound_kinds, section_kinds):
+    """Iterate over the members of those sections of a doxygen xml file whose kind is in
+    section_kinds, within compounds whose kind is in compound_kinds, while the file is being parsed.
+    Yields a tuple (compound, section, member) for each memberdef element as soon as it is complete,
+    and a tuple (compound, None, None) once the whole compound is complete.
+    Each member is removed from its section once the caller is done with it, so that only the
+    remaining (few) child elements of a compound are kept until its end."""
+
+    # Without lxml, we use a parser target that drops all other sections right away, and feed
+    # the file in chunks, so that the collected members can be handed out while parsing.
+    if not HAVE_LXML:
+        target = XmlMemberTarget(compound_kinds, section_kinds)
+        parser = ElementTree.XMLParser(target=target)
+        with open(filename, "rb") as xml_file:
+            while True:
+                chunk = xml_file.read(65536)
+                if chunk:
+                    parser.feed(chunk)
+                else:
+                    parser.close()
+
+                items = target.items
+                target.items = []
+                for compound, section, member in items:
+                    yield compound, section, member
+                    if member is not None:
+                        section.remove(member)
+                    else:
+                        compound.clear()
+
+                if not chunk:
+                    break
+        return
+
+    # With lxml, we let the parser only report the three tags that we need here, so that
+    # the many elements within the members do not produce any events that we would have to loop
+    # over. Whether the members of a section are wanted is decided once per section.
+    context = ElementTree.iterparse(
+        filename, events=("start", "end"), tag=("compounddef", "sectiondef", "memberdef"),
+        **LXML_PARSER_OPTIONS
+    )
+
+    compound = None
+    section  = None
+    wanted   = False
+    for event, elem in context:
+
+        # We only need the start events to know the enclosing elements of the members.
+        if event == "start":
+            if elem.tag == "compounddef":
+                compound = elem
+            elif elem.tag == "sectiondef":
+                section  = elem
+                wanted   = (
+                    compound is not None and
+                    compound.attrib["kind"] in compound_kinds and
+                    section.attrib["kind"] in section_kinds
+                )
+            continue
+
+        if elem.tag == "memberdef" and section is not None:
+            if wanted:
+                yield compound, section, elem
+            section.remove(elem)
+
+        elif elem.tag == "sectiondef":
+            section = None
+            wanted  = False
+
+        elif elem.tag == "compounddef":
+            if compound.attrib["kind"] in compound_kinds:
+                yield compound, None, None
+            compound.clear()
+            compound = None
 
 # ==================================================================================================
 #     Class: Doxygen Reader
@@ -38,16 +222,23 @@ class DoxygenReader:
     # ----------------------------------------------------------------
 
     @staticmethod
-    def parse_template_parameters (compound):
-        if compound.find("templateparamlist") is not None:
+    def parse_template_parameters (templateparamlist):
+        """Parse a templateparamlist element into a list of parameter strings. The element is
+        handed in by the caller, which already has the child elements of the compound at hand.
+        Returns None if the element is None, i.e., if the compound is not a template."""
+        if templateparamlist is not None:
             param_list = []
-            for param in compound.find("templateparamlist"):
+            for param in templateparamlist:
                 if not param.tag == "param":
-                    print "Warn: Unknown template parameter tag:", param.tag
+                    print("Warn: Unknown template parameter tag:", param.tag)
 
-                param_str = ''.join(param.find("type").itertext()).strip()
-                if param.find("declname") is not None:
-                    param_str += " " + ''.join(param.find("declname").itertext()).strip()
+                p_children = {}
+                for child in param:
+                    p_children.setdefault(child.tag, child)
+
+                param_str = XmlElementText(p_children.get("type")).strip()
+                if "declname" in p_children:
+                    param_str += " " + XmlElementText(p_children["declname"]).strip()
                 param_list.append(param_str)
             return param_list
         return None
@@ -59,37 +250,57 @@ class DoxygenReader:
     @staticmethod
     def parse_function (member):
         if member.tag != "memberdef":
-            print "Invalid xml tag:", member.tag
+            print("Invalid xml tag:", member.tag)
             return None
         if member.attrib["kind"] != "function":
-            print "Invalid member kind:", member.attrib["kind"]
+            print("Invalid member kind:", member.attrib["kind"])
             return None
 
+        # Collect the child elements in one pass, instead of searching for each of them.
+        # As with find(), we use the first element of each tag.
+        children = {}
+        params   = []
+        for child in member:
+            if child.tag == "param":
+                params.append(child)
+            else:
+                children.setdefault(child.tag, child)
+
+        # Names, types and locations repeat a lot across functions, e.g., "size_t" or "void".
+        # We intern them, so that all functions share one string object for each of them. This
+        # saves memory, and the results that the worker processes send back get smaller, as pickle
+        # then only needs to store each such string once per file.
         func = CppFunction()
-        func.name = member.find("name").text
-        func.type = ''.join(member.find("type").itertext())
+        func.name = sys.intern(children["name"].text)
+        func.type = sys.intern(XmlElementText(children.get("type")))
 
-        func.template_params = DoxygenReader.parse_template_parameters(member)
+        func.template_params = DoxygenReader.parse_template_parameters(
+            children.get("templateparamlist")
+        )
 
         func.prot    = (member.attrib["prot"])
         func.static  = (member.attrib["static"] == "yes")
         func.const   = (member.attrib["const"]  == "yes")
         func.virtual = (member.attrib["virt"]   == "virtual")
 
-        for p in member.findall("param"):
+        for p in params:
+            p_children = {}
+            for child in p:
+                p_children.setdefault(child.tag, child)
+
             param = CppParameter()
-            param.type = ''.join(p.find("type").itertext()).strip()
-            if p.find("declname") is not None:
-                param.name = p.find("declname").text
-            if p.find("defval") is not None:
-                param.value = p.find("defval").text
+            param.type = sys.intern(XmlElementText(p_children.get("type")).strip())
+            if "declname" in p_children:
+                param.name = p_children["declname"].text
+            if "defval" in p_children:
+                param.value = p_children["defval"].text
             if param.value is None:
                 param.value = ""
             func.params.append(param)
 
-        func.briefdescription    = ''.join(member.find("briefdescription").itertext()).strip()
-        func.detaileddescription = ''.join(member.find("detaileddescription").itertext()).strip()
-        func.location            = member.find("location").attrib["file"]
+        func.briefdescription    = XmlElementText(children.get("briefdescription")).strip()
+        func.detaileddescription = XmlElementText(children.get("detaileddescription")).strip()
+        func.location            = sys.intern(children["location"].attrib["file"])
 
         # unused properties of the xml element:
         # print "definition:",x.find("definition").text
@@ -103,86 +314,91 @@ class DoxygenReader:
 
     @staticmethod
     def parse_class_file (filename):
-        tree = xml.etree.ElementTree.parse(filename)
-        root = tree.getroot()
+        classes   = []
+        functions = []
 
-        classes = []
-        # for compound in root.iter("compound"):
-        for compound in root:
-            if not compound.attrib["kind"] in [ "class", "struct" ]:
+        # Stream the file, and parse each member function as soon as its element is complete,
+        # instead of waiting for the whole compounddef. The members make up most of a class file.
+        # All members of other sections (e.g., private ones) are dropped while parsing.
+        members = XmlIterMembers(
+            filename, [ "class", "struct" ], [ "public-func", "public-static-func" ]
+        )
+        for compound, section, member in members:
+
+            # The compound is complete, so we can make a class from it.
+            if member is None:
+                classes.append(DoxygenReader.parse_class_compound(compound, functions))
+                functions = []
                 continue
 
-            clss_name = compound.find("compoundname").text.rsplit('::', 1)[1]
-            clss = CppClass(clss_name)
-
-            clss.template_params     = DoxygenReader.parse_template_parameters(compound)
-            clss.briefdescription    = ''.join(compound.find("briefdescription").itertext()).strip()
-            clss.detaileddescription = ''.join(compound.find("detaileddescription").itertext()).strip()
-
-            # doxygen sets the class-wide location to the file where the class is first used,
-            # which often is a forward declaration, but not the actual definition of the class.
-            # so we need to check the location attributes of the functions instead.
-            locations = set()
-
-            for section in compound:
-                if section.tag != "sectiondef":
-                    continue
-
-                if not section.attrib["kind"] in [ "public-func", "public-static-func" ]:
-                    continue
-
-                for member in section:
-                    if not member.attrib["kind"] == "function":
-                        print "Weird. Member in section '"+section.attrib["kind"]+"' that is not a function."
-                        continue
-
-                    func = DoxygenReader.parse_function(member)
-                    func.parent = clss
-                    locations.add(func.location)
-                    clss.add_function (func)
-
-            if len(locations) > 1:
-                print "Weird. Multiple locations for class", clss_name, ":", locations
-            if len(locations) == 0:
-                clss.location = compound.find("location").attrib["file"]
+            if member.attrib["kind"] == "function":
+                functions.append(DoxygenReader.parse_function(member))
             else:
-                clss.location = locations.pop()
-
-            classes.append(clss)
+                print("Weird. Member in section '"+section.attrib["kind"]+"' that is not a function.")
 
-        classes = sorted(classes, key=lambda clss: clss.name)
+        # No need to sort here: the namespace keeps its classes in a dict,
+        # and all users of that dict iterate it in sorted order anyway.
         return classes
 
+    @staticmethod
+    def parse_class_compound (compound, functions):
+        """Create a class from its compounddef element and the list of its already parsed public
+        member functions. The member elements are not needed any more at this point."""
+
+        # Collect the child elements in one pass. Sections are skipped, as their members have
+        # already been parsed.
+        children = {}
+        for child in compound:
+            if child.tag != "sectiondef":
+                children.setdefault(child.tag, child)
+
+        clss_name = children["compoundname"].text.rsplit('::', 1)[1]
+        clss = CppClass(clss_name)
+
+        clss.template_params     = DoxygenReader.parse_template_parameters(
+            children.get("templateparamlist")
+        )
+        clss.briefdescription    = XmlElementText(children.get("briefdescription")).strip()
+        clss.detaileddescription = XmlElementText(children.get("detaileddescription")).strip()
+
+        # doxygen sets the class-wide location to the file where the class is first used,
+        # which often is a forward declaration, but not the actual definition of the class.
+        # so we need to check the location attributes of the functions instead.
+        locations = set()
+
+        for func in functions:
+            func.parent = clss
+            locations.add(func.location)
+            clss.add_function (func)
+
+        if len(locations) > 1:
+            print("Weird. Multiple locations for class", clss_name, ":", locations)
+        if len(locations) == 0:
+            clss.location = children["location"].attrib["file"]
+        else:
+            clss.location = locations.pop()
+
+        return clss
+
     # ----------------------------------------------------------------
     #     Parse Namespace
     # ----------------------------------------------------------------
 
     @staticmethod
     def parse_namespace_file (filename):
-        tree = xml.etree.ElementTree.parse(filename)
-        root = tree.getroot()
-
         functions = []
-        for compound in root:
-            if not compound.attrib["kind"] == "namespace":
-                continue
-
-            for section in compound:
-                if section.tag != "sectiondef":
-                    continue
-
-                if not section.attrib["kind"] in [ "func" ]:
-                    continue
 
-                for member in section:
-                    if not member.attrib["kind"] == "function":
-                        print "Weird. Member in section '"+section.attrib["kind"]+"' that is not a function."
-                        continue
+        # Stream the file member by member, see parse_class_file().
+        for compound, section, member in XmlIterMembers(filename, [ "namespace" ], [ "func" ]):
+            if member is None:
+                continue
 
-                    func = DoxygenReader.parse_function(member)
-                    functions.append(func)
+            if member.attrib["kind"] == "function":
+                functions.append(DoxygenReader.parse_function(member))
+            else:
+                print("Weird. Member in section '"+section.attrib["kind"]+"' that is not a function.")
 
-        functions = sorted(functions, key=lambda func: func.name)
+        functions.sort(key=attrgetter("name"))
         return functions
 
     # ----------------------------------------------------------------
@@ -190,12 +406,20 @@ class DoxygenReader:
     # ----------------------------------------------------------------
 
     @staticmethod
-    def parse_xml_dir (directory):
-        tree = xml.etree.ElementTree.parse(os.path.join(directory, "index.xml"))
-        root = tree.getroot()
+    def parse_xml_dir (directory, processes=None):
+        """Read the doxygen xml output in the given directory into a global namespace object.
+        The class and namespace files are parsed in parallel if possible, using the given number
+        of worker processes, or all cores if not set, see ParallelMap()."""
+
+        # Lists of (namespace, xml file) for all classes and namespaces, which are parsed later.
+        class_jobs     = []
+        namespace_jobs = []
 
         ns_global = CppNamespace("")
-        for compound in root:
+
+        # Index of namespace paths (as tuples of names) to the namespace objects.
+        ns_index  = { (): ns_global }
+        for compound in XmlIterElements(os.path.join(directory, "index.xml"), "compound"):
 
             # Process all elements of the namespace.
             if compound.attrib["kind"] in [ "class", "struct", "namespace" ]:
@@ -212,37 +436,52 @@ class DoxygenReader:
                     elem_name  = elem_ns_list.pop()
 
                 # Move into the namespace of that element,
-                # create parent namespaces when necessary.
-                ns_local = ns_global
-                for ns in elem_ns_list:
-                    ns_local.create_namespace(ns)
-                    ns_tmp   = ns_local
-                    ns_local = ns_local.namespaces[ns]
-                    ns_local.parent = ns_tmp
+                # create parent namespaces when necessary. Most elements share their namespace
+                # with others, so we first try to find it directly by its path.
+                ns_path  = tuple(elem_ns_list)
+                ns_local = ns_index.get(ns_path)
+                if ns_local is None:
+                    ns_local = ns_global
+                    for depth, ns in enumerate(elem_ns_list):
+                        ns_local.create_namespace(ns)
+                        ns_tmp   = ns_local
+                        ns_local = ns_local.namespaces[ns]
+                        ns_local.parent = ns_tmp
+                        ns_index[ ns_path[ : depth+1 ] ] = ns_local
 
                 # Get the details file for the class and parse it.
                 xml_file = os.path.join(directory, compound.attrib["refid"] + ".xml")
 
-                # Parse if the element is a class or struct.
+                # Collect the element if it is a class or struct.
                 if compound.attrib["kind"] in [ "class", "struct" ]:
-                    for clss in DoxygenReader.parse_class_file (xml_file):
-                        clss.parent = ns_local
-                        ns_local.add_class (clss)
+                    class_jobs.append(( ns_local, xml_file ))
 
-                # Parse if the element is a namespace.
-                # Currently, the namespace parser only returns functions.
-                # If this changes, the following needs to be adapted accordingly.
+                # Collect the element if it is a namespace.
                 if compound.attrib["kind"] == "namespace":
-                    for func in DoxygenReader.parse_namespace_file (xml_file):
-                        func.parent = ns_local
-                        ns_local.add_function (func)
+                    namespace_jobs.append(( ns_local, xml_file ))
+
+        # The xml files are independent of each other, so we can parse them in parallel, in one go
+        # for both kinds of files. Results are handed out in chunks to amortize the inter-process
+        # overhead, and come back in the order of the jobs, so that the tree is built the same way
+        # as in a serial run.
+        parse_jobs = (
+            [ ( DoxygenReader.parse_namespace_file, job[1] ) for job in namespace_jobs ] +
+            [ ( DoxygenReader.parse_class_file,     job[1] ) for job in class_jobs ]
+        )
+        results = ParallelMap( lambda job: job[0]( job[1] ), parse_jobs, processes, 8 )
+
+        # Currently, the namespace parser only returns functions.
+        # If this changes, the following needs to be adapted accordingly.
+        for i, functions in enumerate( results[ : len(namespace_jobs) ] ):
+            ns_local = namespace_jobs[i][0]
+            for func in functions:
+                func.parent = ns_local
+                ns_local.add_function (func)
+
+        for i, classes in enumerate( results[ len(namespace_jobs) : ] ):
+            ns_local = class_jobs[i][0]
+            for clss in classes:
+                clss.parent = ns_local
+                ns_local.add_class (clss)
 
         return ns_global
-
-# ==================================================================================================
-#     Main
-# ==================================================================================================
-
-if __name__ == "__main__":
-    print "This has no main function."
-    sys.exit()
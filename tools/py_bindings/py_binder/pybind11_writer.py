@@ -1,4 +1,4 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 # Genesis - A toolkit for working with phylogenetic data.
 # Copyright (C) 2014-2018 Lucas Czech and HITS gGmbH
@@ -21,31 +21,133 @@
 # Exelixis Lab, Heidelberg Institute for Theoretical Studies
 # Schloss-Wolfsbrunnenweg 35, D-69118 Heidelberg, Germany
 
+import io
 import os
-import re
 
-from cpp_entities import *
+from collections import defaultdict
+
+from .cpp_entities import *
+from .writer_helpers import *
 
 # ==================================================================================================
 #     Helper Functions
 # ==================================================================================================
 
-def CamelCaseToUnderscore(name):
-    s1 = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
-    return re.sub('([a-z0-9])([A-Z])', r'\1_\2', s1).lower()
-
-def CppEscapeString(txt):
-    return txt.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
-
-# Helper struct that collects all the information that goes into one file.
-class ExportFile:
-    def __init__ (self):
-        self.scope            = ""
-        self.using            = ""
-        self.includes         = []
-        self.class_strings    = {}
-        self.function_strings = []
-        self.func_templates   = {}
+# Templates for the bindings of free functions, class constructors, methods, and iterators. The
+# scaffolding is the same for all of them, so only the parts that differ are filled in.
+_function_template = (
+    "    scope.def(\n"
+    "        \"%s\",\n"
+    "        ( %s ( * )( %s ))( &%s )%s%s"
+    "    );\n"
+)
+_method_template = (
+    "        .def%s(\n"
+    "            \"%s\",\n"
+    "            ( %s ( %s )( %s )%s)( &%s::%s )%s%s"
+    "        )\n"
+)
+_constructor_template = (
+    "        .def(\n"
+    "            pybind11::init< %s >()%s%s"
+    "        )\n"
+)
+_iterator_template = (
+    "        .def(\n"
+    "            \"%s\",\n"
+    "            []( %s& obj ){\n"
+    "                return pybind11::make_iterator( obj.%s(), obj.%s() );\n"
+    "            },\n"
+    "            py::keep_alive<0, 1>()\n"
+    "        )\n"
+)
+
+# Templates for the bindings of the operators of each kind, see generate_class_operators(). They are
+# filled with the operator symbol (and the class name), by name, so that each can use what it needs.
+# Array operators get a method binding instead, and kinds that map to None are not exported.
+_operator_templates = {
+    "inplace":     "        .def( pybind11::self %(symbol)s pybind11::self )\n",
+    "comparison":  "        .def( pybind11::self %(symbol)s pybind11::self )\n",
+    "unary":       "        .def( %(symbol)spybind11::self )\n",
+    "ostream":     (
+        "        .def(\n"
+        "            \"__str__\",\n"
+        "            []( %(full_name)s const& obj ) -> std::string {\n"
+        "                std::ostringstream s;\n"
+        "                s << obj;\n"
+        "                return s.str();\n"
+        "            }\n"
+        "        )\n"
+    ),
+    "access":      None,
+    "dereference": None,
+    "crement":     None,
+    "assignment":  None,
+    "conversion":  None
+}
+
+# Templates for the export blocks of classes and of class templates, and for the type alias
+# that the bindings of a class template use to refer to the class.
+_class_export_template = (
+    "PYTHON_EXPORT_CLASS( %s, scope )\n"
+    "{\n"
+    "%s}\n"
+)
+_class_template_export_template = (
+    "template <%s>\n"
+    "void PythonExportClass_%s(std::string name)\n"
+    "{\n"
+    "%s}\n"
+)
+_class_template_using_template = (
+    "    using namespace %s;\n\n"
+    "    using %sType = %s<%s>;\n\n"
+)
+
+# Intro of each export file, which is the same for all of them.
+_export_file_intro = (
+    "/**\n"
+    " * @brief\n"
+    " *\n"
+    " * @file\n"
+    " * @ingroup python\n"
+    " */\n\n"
+    "#include <src/common.hpp>\n\n"
+    "#include \"genesis/genesis.hpp\"\n"
+)
+
+# Intro and outro of the docstring file, around the entries of the docstring map.
+_docstring_file_intro = (
+    "/**\n"
+    "* @brief Documentation strings for the Python module.\n"
+    " *\n"
+    " * @file\n"
+    " * @ingroup python\n"
+    " */\n"
+    "\n"
+    "#include <src/common.hpp>\n"
+    "\n"
+    "#include <map>\n"
+    "#include <string>\n"
+    "\n"
+    "static std::map<std::string, std::string> doc_strings_ = {\n"
+)
+_docstring_entry_template = "    {\"%s\", \"%s\"},\n"
+_docstring_file_outro = (
+    "};\n"
+    "\n"
+    "const char* get_docstring (const std::string& signature)\n"
+    "{\n"
+    "    if (doc_strings_.count(signature) > 0) {\n"
+    "        return doc_strings_[signature].c_str();\n"
+    "    } else {\n"
+    "        return \"\";\n"
+    "    }\n"
+    "}\n"
+)
+
+# Cache for generate_param_lists(), keyed by the types, names and default values of the parameters.
+_param_lists_cache = {}
 
 # ==================================================================================================
 #     Class: Pybind11 Writer
@@ -59,10 +161,7 @@ class Pybind11Writer:
 
     @staticmethod
     def make_section_header (symbol, title, indent = 0, length = 80):
-        val  = "\n" + " " * indent + "// " + symbol * (length-3) + "\n"
-        val += " " * indent + "//     " + title + "\n"
-        val += " " * indent + "// " + symbol * (length-3) + "\n\n"
-        return val
+        return SectionHeader (symbol, title, indent, length)
 
     @staticmethod
     def make_section_header_major (title, indent = 0, length = 80):
@@ -72,39 +171,64 @@ class Pybind11Writer:
     def make_section_header_minor(title, indent = 4, length = 70):
         return Pybind11Writer.make_section_header ("-", title, indent, length)
 
+    # ----------------------------------------------------------------
+    #     Generate Parameters
+    # ----------------------------------------------------------------
+
+    @staticmethod
+    def generate_param_lists (params, default_name = ""):
+        """Return the comma separated parameter types and pybind11::arg() entries
+        (each starting with a separating comma) of a function, in one pass over the parameters.
+        Parameters without a name get the default name. Many functions share the same parameters,
+        so the results are cached by the types, names and default values of the parameters."""
+        # Many functions do not have any parameters, so we do not even need a key for them.
+        if len(params) == 0:
+            return "", ""
+
+        key = ( default_name, tuple([ ( param.type, param.name, param.value ) for param in params ]) )
+        res = _param_lists_cache.get(key)
+        if res is not None:
+            return res
+
+        param_types = []
+        param_args  = []
+        for param in params:
+            name = param.name if param.name != "" else default_name
+            param_types.append( param.type )
+            if param.value == "":
+                param_args.append( ",\n            pybind11::arg(\"%s\")" % name )
+            else:
+                param_args.append( ",\n            pybind11::arg(\"%s\")=(%s)(%s)" % (
+                    name, param.type, param.value
+                ))
+
+        res = ( ", ".join(param_types), "".join(param_args) )
+        _param_lists_cache[key] = res
+        return res
+
     # ----------------------------------------------------------------
     #     Generate Free Functions
     # ----------------------------------------------------------------
 
     @staticmethod
     def generate_function_body (func, py_name = ""):
-        val  = "    scope.def(\n"
-        val += "        \"" + (func.name if py_name == "" else py_name) + "\",\n"
-        val += "        ( " + func.type + " ( * )( "
-        val += ", ".join(
-            (
-                param.type
-            ) for param in func.params
-        )
-        val += " )"
-        val += ")( &" + func.cpp_full_name() + " )"
-
-        if len(func.params) > 0:
-            for param in func.params:
-                val += ",\n            "
-                val += "pybind11::arg(\"" + param.name + "\")" + (
-                    "" if param.value == "" else
-                    "=(" + param.type + ")(" + param.value + ")"
-                )
+        param_types, param_args = Pybind11Writer.generate_param_lists( func.params )
 
         # if func.type.strip().endswith("*") or func.type.strip().endswith("&"):
-        #     val += ",\n        boost::python::return_value_policy<boost::python::reference_existing_object>()"
+        #     add ",\n        boost::python::return_value_policy<boost::python::reference_existing_object>()"
         if func.briefdescription != "":
-            val += ",\n        get_docstring(\"" + CppEscapeString( func.cpp_signature() ) + "\")\n"
+            doc = ",\n        get_docstring(\"%s\")\n" % CppEscapeString( func.cpp_signature() )
         else:
-            val += "\n"
-        val += "    );\n"
-        return val
+            doc = "\n"
+
+        return _function_template % (
+            func.name if py_name == "" else py_name,
+            func.type,
+            param_types,
+            func.cpp_full_name(),
+            param_args,
+            doc
+        )
 
     # ----------------------------------------------------------------
     #     Generate Class Header
@@ -114,36 +238,28 @@ class Pybind11Writer:
     def generate_class_header (clss):
         if clss.template_params is None:
             ctype = clss.cpp_full_name()
-            name  = "\"" + clss.name + "\""
+            name  = "\"%s\"" % clss.name
         else:
             ctype = clss.name + "Type"
             name  = "name.c_str()"
 
-        val  = "    pybind11::class_< " + ctype + ", std::shared_ptr<" + ctype + "> > "
-        val += "( scope, " + name + " )\n"
-
-        if len(clss.ctors) > 0:
-            for ctor in clss.ctors:
-                # Skip move constructor
-                if len(ctor.params) == 1 and ctor.params[0].type == clss.name + " &&":
-                    continue
-
-                val += "        .def(\n"
-                val += "            pybind11::init< "
-                val += ", ".join ( param.type for param in ctor.params )
-                val += " >()"
-                for param in ctor.params:
-                    val += ",\n            "
-                    val += "pybind11::arg(\"" + ( param.name if param.name != "" else "arg" ) + "\")" + (
-                        "" if param.value == "" else
-                        "=(" + param.type + ")(" + param.value + ")"
-                    )
-                if ctor.briefdescription != "":
-                    val += ",\n            get_docstring(\"" + CppEscapeString( ctor.cpp_signature() ) + "\")\n"
-                else:
-                    val += "\n"
-                val += "        )\n"
-        return val
+        val = [ "    pybind11::class_< %s, std::shared_ptr<%s> > ( scope, %s )\n" % (
+            ctype, ctype, name
+        ) ]
+
+        move_ctor_type = clss.name + " &&"
+        for ctor in clss.ctors:
+            # Skip move constructor
+            if len(ctor.params) == 1 and ctor.params[0].type == move_ctor_type:
+                continue
+
+            param_types, param_args = Pybind11Writer.generate_param_lists( ctor.params, "arg" )
+            if ctor.briefdescription != "":
+                doc = ",\n            get_docstring(\"%s\")\n" % CppEscapeString( ctor.cpp_signature() )
+            else:
+                doc = "\n"
+            val.append( _constructor_template % ( param_types, param_args, doc ))
+        return "".join(val)
 
     # ----------------------------------------------------------------
     #     Generate Class Methods
@@ -156,56 +272,62 @@ class Pybind11Writer:
         if ctype is None:
             ctype = func.parent.cpp_full_name()
 
-        val  = "        .def" + ( "_static" if func.static else "" ) + "(\n"
-        val += "            \"" + (func.name if py_name == None else py_name) + "\",\n"
-        val += "            ( " + func.type + " ( "
-        val += "*" if func.static else ctype + "::*"
-        val += " )( "
-        val += ", ".join(
-            (
-                param.type
-            ) for param in func.params
-        )
-        val += " )"
-        val += " const " if func.const else ""
-        val += ")( &" + ctype + "::" + func.name + " )"
-        if len(func.params) > 0:
-            for param in func.params:
-                val += ",\n            "
-                val += "pybind11::arg(\"" + param.name + "\")" + (
-                    "" if param.value == "" else
-                    "=(" + param.type + ")(" + param.value + ")"
-                )
+        param_types, param_args = Pybind11Writer.generate_param_lists( func.params )
 
         # if func.type.strip().endswith("*") or func.type.strip().endswith("&"):
-        #     val += ",\n            boost::python::return_value_policy<boost::python::reference_existing_object>()"
+        #     add ",\n            boost::python::return_value_policy<boost::python::reference_existing_object>()"
         if func.briefdescription != "":
-            # val += ",\n            \"" + func.briefdescription + "\"\n"
-            val += ",\n            get_docstring(\"" + CppEscapeString( func.cpp_signature() ) + "\")\n"
+            # doc = ",\n            \"%s\"\n" % func.briefdescription
+            doc = ",\n            get_docstring(\"%s\")\n" % CppEscapeString( func.cpp_signature() )
         else:
-            val += "\n"
-        val += "        )\n"
-        return val
+            doc = "\n"
+
+        return _method_template % (
+            "_static" if func.static else "",
+            func.name if py_name == None else py_name,
+            func.type,
+            "*" if func.static else ctype + "::*",
+            param_types,
+            " const " if func.const else "",
+            ctype,
+            func.name,
+            param_args,
+            doc
+        )
 
     @staticmethod
     def generate_class_methods (clss):
         if len(clss.methods) == 0:
             return ""
 
+        # The class type is the same for all functions of the class, so we look it up once here,
+        # instead of letting generate_class_function_body() get it from each function's parent.
         if clss.template_params is None:
-            ctype = None
+            ctype = clss.cpp_full_name()
         else:
             ctype = clss.name + "Type"
 
-        val = "\n        // Public Member Functions\n\n"
+        # The key holds everything that goes into the binding code of a method, so that methods which
+        # would result in the same code are skipped before generating it, instead of removing the
+        # duplicate code afterwards. The (cached) signature already contains all of that, apart from
+        # whether the method has a docstring.
+        # The bindings are sorted by their code. As the code of each method starts with the same
+        # scaffolding (".def" or ".def_static"), followed by the method name, we sort by these first,
+        # and only compare the code of methods with the same name (overloads). This results in the
+        # same order.
+        seen   = set()
         m_list = []
         for func in clss.methods:
-            m_list.append(Pybind11Writer.generate_class_function_body (func, ctype=ctype))
+            key = ( func.cpp_signature(), func.briefdescription != "" )
+            if key in seen:
+                continue
+            seen.add(key)
 
-        for d in sorted(set(m_list)):
-            val += d
+            code = Pybind11Writer.generate_class_function_body (func, ctype=ctype)
+            m_list.append( ( func.static, func.name, code ) )
+        m_list.sort()
 
-        return val
+        return "\n        // Public Member Functions\n\n" + "".join([ m[-1] for m in m_list ])
 
     # ----------------------------------------------------------------
     #     Generate Class Operators
@@ -215,93 +337,40 @@ class Pybind11Writer:
 
     @staticmethod
     def classify_operator (op):
-        if not op.name.startswith("operator"):
-            return None
-
-        symbol = op.name[len("operator"):].strip()
-        if symbol in [ "+=", "-=", "*=", "/=", "%=", ">>=", "<<=", "&=", "^=", "|=" ]:
-            return (symbol, "inplace")
-
-        if symbol in [ "==", "!=", "<", ">", "<=", ">=" ]:
-            return (symbol, "comparison")
-
-        if symbol in [ "-", "+", "~", "!" ]:
-            return (symbol, "unary")
-
-        if symbol == "[]":
-            return (symbol, "array")
-
-        if symbol == "()":
-            return (symbol, "access")
-
-        if symbol == "<<":
-            return (symbol, "ostream")
-
-        if symbol in [ "*", "->" ]:
-            return (symbol, "dereference")
-
-        if symbol in [ "++", "--" ]:
-            return (symbol, "crement")
-
-        if symbol == "=":
-            return (symbol, "assignment")
-
-        if symbol in [ "bool" ]:
-            return (symbol, "conversion")
-
-        return None
+        return ClassifyOperator(op.name)
 
     @staticmethod
     def generate_class_operators (clss):
         if len(clss.operators) == 0:
             return ""
 
+        # Class type, looked up once, see generate_class_methods().
         if clss.template_params is None:
-            ctype = None
+            ctype = clss.cpp_full_name()
         else:
             ctype = clss.name + "Type"
 
         # TODO missing doc strings here!
-        val = ""
+        full_name = clss.cpp_full_name()
+        val = []
         for operator in clss.operators:
             op_class = Pybind11Writer.classify_operator(operator)
             if op_class is None:
-                print "Weird. Empty operator in class", clss.name
-                pass
-
-            elif op_class[1] in [ "inplace", "comparison" ]:
-                val += "        .def( pybind11::self " + op_class[0] + " pybind11::self )\n"
-
-            elif op_class[1] == "unary":
-                val += "        .def( " + op_class[0] + "pybind11::self )\n"
-
-            elif op_class[1] == "array":
-                val += Pybind11Writer.generate_class_function_body (operator, ctype=ctype, py_name="__getitem__")
-
-            elif op_class[1] == "access":
-                pass
-
-            elif op_class[1] == "ostream":
-                val += "        .def(\n"
-                val += "            \"__str__\",\n"
-                val += "            []( " + clss.cpp_full_name() + " const& obj ) -> std::string {\n"
-                val += "                std::ostringstream s;\n"
-                val += "                s << obj;\n"
-                val += "                return s.str();\n"
-                val += "            }\n"
-                val += "        )\n"
-
-            elif op_class[1] in [ "dereference", "crement", "assignment", "conversion" ]:
-                pass
+                print("Weird. Empty operator in class", clss.name)
+                continue
 
-            else:
-                print "Operator type not handled:", op_class[1], operator.name
-                pass
+            symbol, kind = op_class
+            if kind == "array":
+                val.append( Pybind11Writer.generate_class_function_body (operator, ctype=ctype, py_name="__getitem__") )
+            elif kind not in _operator_templates:
+                print("Operator type not handled:", kind, operator.name)
+            elif _operator_templates[kind] is not None:
+                val.append( _operator_templates[kind] % { "symbol": symbol, "full_name": full_name } )
 
         # If we actually added operators, make a section for them.
-        if val != "":
-            val = "\n        // Operators\n\n" + val
-        return val
+        if len(val) == 0:
+            return ""
+        return "\n        // Operators\n\n" + "".join(val)
 
     # ----------------------------------------------------------------
     #     Generate Class Iterators
@@ -319,23 +388,16 @@ class Pybind11Writer:
 
         # TODO missing doc strings here!
         # TODO add iterators with parameters
-        val = "\n        // Iterators\n\n"
+        full_name = clss.cpp_full_name()
+        val = [ "\n        // Iterators\n\n" ]
         for it in clss.iterators:
-            val += "        .def(\n"
             # if it.name == "__iter__":
-            #     val += "        .def(\n"
+            #     use ".def(" as below
             # else:
-            #     val += "        .add_property(\n"
-
-            val += "            \"" + it.name + "\",\n"
-            val += "            []( " + clss.cpp_full_name() + "& obj ){\n"
-            val += "                return pybind11::make_iterator( "
-            val += "obj." + it.begin + "(), obj." + it.end + "() );\n"
-            val += "            },\n"
-            val += "            py::keep_alive<0, 1>()\n"
-            val += "        )\n"
+            #     use ".add_property(" instead
+            val.append( _iterator_template % ( it.name, full_name, it.begin, it.end ))
 
-        return val
+        return "".join(val)
 
     # ----------------------------------------------------------------
     #     Generate Class
@@ -343,39 +405,42 @@ class Pybind11Writer:
 
     @staticmethod
     def generate_class (clss):
-        val = Pybind11Writer.make_section_header_minor ("Class " + clss.name)
+        val = [ Pybind11Writer.make_section_header_minor ("Class " + clss.name) ]
 
-        if clss.template_params is None:
-            val += Pybind11Writer.generate_class_header (clss)
-        else:
-            val += "    using namespace " + clss.parent.cpp_full_name() + ";\n\n"
-            val += "    using " + clss.name + "Type = "
-            val += clss.name + "<" + ", ".join(clss.template_params) + ">;\n\n"
-            val += Pybind11Writer.generate_class_header (clss)
+        if clss.template_params is not None:
+            val.append( _class_template_using_template % (
+                clss.parent.cpp_full_name(), clss.name, clss.name, ", ".join(clss.template_params)
+            ))
 
-        val += Pybind11Writer.generate_class_methods (clss)
-        val += Pybind11Writer.generate_class_operators (clss)
-        val += Pybind11Writer.generate_class_iterators (clss)
-        val += "    ;\n"
-        return val
+        val.append( Pybind11Writer.generate_class_header    (clss) )
+        val.append( Pybind11Writer.generate_class_methods   (clss) )
+        val.append( Pybind11Writer.generate_class_operators (clss) )
+        val.append( Pybind11Writer.generate_class_iterators (clss) )
+        val.append( "    ;\n" )
+        return "".join(val)
 
     # ----------------------------------------------------------------
     #     Generate Namespace
     # ----------------------------------------------------------------
 
     @staticmethod
-    def generate_namespace (namespace):
-        val = ""
-
+    def iter_namespace (namespace):
+        """Yield the bindings of a namespace and its sub-namespaces piece by piece, one class at a
+        time, so that the whole output does not need to be held in memory at once."""
         if len(namespace.classes) > 0:
-            val += Pybind11Writer.make_section_header_major ("Classes")
-        for name in sorted(namespace.classes):
-            val += Pybind11Writer.generate_class (namespace.classes[name]) + "\n"
+            yield Pybind11Writer.make_section_header_major ("Classes")
+        for name in namespace.sorted_classes():
+            yield Pybind11Writer.generate_class (namespace.classes[name])
+            yield "\n"
 
-        for name in sorted(namespace.namespaces):
-            val += Pybind11Writer.make_section_header_major ("Namespace " + name)
-            val += Pybind11Writer.generate_namespace (namespace.namespaces[name]) + "\n"
-        return val
+        for name in namespace.sorted_namespaces():
+            yield Pybind11Writer.make_section_header_major ("Namespace " + name)
+            yield from Pybind11Writer.iter_namespace (namespace.namespaces[name])
+            yield "\n"
+
+    @staticmethod
+    def generate_namespace (namespace):
+        return "".join( Pybind11Writer.iter_namespace (namespace) )
 
     # ----------------------------------------------------------------
     #     Generate Docstring File
@@ -383,61 +448,52 @@ class Pybind11Writer:
 
     @staticmethod
     def generate_docstring_file (namespace, directory):
-        written_signatures = []
-        fn = os.path.join(directory, "docstrings.cpp")
-        f = open(fn, 'w')
-
-        f.write("/**\n")
-        f.write("* @brief Documentation strings for the Python module.\n")
-        f.write(" *\n")
-        f.write(" * @file\n")
-        f.write(" * @ingroup python\n")
-        f.write(" */\n")
-        f.write("\n")
-        f.write("#include <src/common.hpp>\n")
-        f.write("\n")
-        f.write("#include <map>\n")
-        f.write("#include <string>\n")
-        f.write("\n")
-        f.write ("static std::map<std::string, std::string> doc_strings_ = {\n")
-
-        def write_docstring( func ):
-            if func.briefdescription != "" or func.detaileddescription != "":
-                if func.cpp_signature() in written_signatures:
-                    print "Warn: Signature already in docstring file:", func.cpp_signature()
-                else:
-                    written_signatures.append( func.cpp_signature() )
-
-                f.write("    {\"" + CppEscapeString( func.cpp_signature() ) + "\", \"")
-                if func.briefdescription != "":
-                    f.write(CppEscapeString(func.briefdescription))
-                if func.briefdescription != "" and func.detaileddescription != "":
-                    f.write("\\n\\n")
-                if func.detaileddescription != "":
-                    f.write(CppEscapeString(func.detaileddescription).encode('utf-8'))
-                f.write("\"},\n")
+        written_signatures = set()
+
+        # Assemble the file in memory, and write it in one go at the end.
+        buf = io.StringIO()
+        w   = buf.write
+        w(_docstring_file_intro)
+
+        def docstring_entry( func ):
+            if func.briefdescription == "" and func.detaileddescription == "":
+                return ""
+
+            # The docstring map only keeps the first entry of each signature anyway,
+            # so we do not need to escape and write the descriptions of later ones.
+            signature = func.cpp_signature()
+            if signature in written_signatures:
+                print("Warn: Signature already in docstring file:", signature)
+                return ""
+            written_signatures.add( signature )
+
+            # Join the descriptions first, so that they are escaped in one pass.
+            # The escaping turns the new lines between them into the "\\n\\n" separator.
+            if func.briefdescription != "" and func.detaileddescription != "":
+                doc = func.briefdescription + "\n\n" + func.detaileddescription
+            else:
+                doc = func.briefdescription or func.detaileddescription
+            return _docstring_entry_template % ( CppEscapeString( signature ), CppEscapeString(doc) )
 
+        # The entries are assembled per class, and written with one call each.
         for clss in namespace.get_all_classes():
-            f.write("    // Class " + clss.name + "\n")
-            for func in sorted(clss.methods, key=lambda x: x.name):
-                write_docstring(func)
-            f.write ("\n")
-
-        f.write("\n    // Functions\n")
-        for func in sorted(namespace.get_all_functions()):
-            write_docstring(func)
-
-        f.write ("};\n")
-        f.write ("\n")
-        f.write ("const char* get_docstring (const std::string& signature)\n")
-        f.write ("{\n")
-        f.write ("    if (doc_strings_.count(signature) > 0) {\n")
-        f.write ("        return doc_strings_[signature].c_str();\n")
-        f.write ("    } else {\n")
-        f.write ("        return \"\";\n")
-        f.write ("    }\n")
-        f.write ("}\n")
-        f.close()
+            w("    // Class " + clss.name + "\n")
+            # No need to sort the methods: the order of the entries does not matter for the map, and
+            # methods with the same signature also have the same name, so that the same one of them
+            # comes first either way.
+            w("".join([ docstring_entry(func) for func in clss.methods ]))
+            w("\n")
+
+        w("\n    // Functions\n")
+        w("".join([ docstring_entry(func) for func in sorted(
+            namespace.get_all_functions(), key=lambda x: ( x.cpp_full_name(), x.cpp_signature() )
+        )]))
+
+        w(_docstring_file_outro)
+
+        fn = os.path.join(directory, "docstrings.cpp")
+        with open(fn, 'w', encoding='utf-8') as f:
+            f.write(buf.getvalue())
 
     # ----------------------------------------------------------------
     #     Generate Docstring File
@@ -448,21 +504,21 @@ class Pybind11Writer:
         """Helper function for the old export way, where the module main file calls all export
         functions explicitly. Not used any more, due to the export registry."""
 
-        fn = os.path.join(directory, "bindings.cpp")
-        f = open(fn, 'w')
-        f.write ("#include <pybind11/pybind11.h>\n")
-        f.write (Pybind11Writer.make_section_header_major("Forward declarations of all exported classes"))
-        for fn, exp in export_files.iteritems():
-             for clss_name, clss_str in exp.class_strings.iteritems():
-                 f.write ("void Pybind11Export_" + clss_name + "();\n")
-
-        f.write (Pybind11Writer.make_section_header_major("Pybind11 Python Module"))
-        f.write ("PYBIND11_PLUGIN(" + module_name + ")\n{\n")
-        for fn, exp in export_files.iteritems():
-             for clss_name, clss_str in exp.class_strings.iteritems():
-                 f.write ("    Pybind11Export_" + clss_name + "();\n")
-        f.write ("}\n")
-        f.close()
+        # Collect the names of all exported classes once, for both the declarations and the calls.
+        clss_names = [ name for exp in export_files.values() for name in exp.class_strings ]
+
+        val = []
+        val.append ("#include <pybind11/pybind11.h>\n")
+        val.append (Pybind11Writer.make_section_header_major("Forward declarations of all exported classes"))
+        val.extend ([ "void Pybind11Export_%s();\n" % name for name in clss_names ])
+
+        val.append (Pybind11Writer.make_section_header_major("Pybind11 Python Module"))
+        val.append ("PYBIND11_PLUGIN(%s)\n{\n" % module_name)
+        val.extend ([ "    Pybind11Export_%s();\n" % name for name in clss_names ])
+        val.append ("}\n")
+
+        with open(os.path.join(directory, "bindings.cpp"), 'w', encoding='utf-8') as f:
+            f.write("".join(val))
 
     # ----------------------------------------------------------------
     #     Write export files
@@ -470,78 +526,81 @@ class Pybind11Writer:
 
     @staticmethod
     def write_export_files (export_files, directory):
-        # Write all the files.
-        for filename, exp in export_files.iteritems():
+        # Write all the files. Many of them share their directory, so we only create each directory
+        # once, instead of checking for it for every file.
+        created_dirs = set()
+        for filename, exp in export_files.items():
             if filename.startswith(".") or filename.startswith("/"):
                 filename = "unnamed" + filename
             fn = os.path.join(directory, filename)
             # print "Creating file", fn
 
-            if not os.path.exists(os.path.dirname(fn)):
-                os.makedirs(os.path.dirname(fn))
+            dirname = os.path.dirname(fn) or "."
+            if dirname not in created_dirs:
+                os.makedirs(dirname, exist_ok=True)
+                created_dirs.add(dirname)
 
             if os.path.isfile(fn):
-                print "Warn: File already exists:", fn
-
-            # Write file intro.
-            f = open(fn, 'w')
-            f.write("/**\n")
-            f.write(" * @brief\n")
-            f.write(" *\n")
-            f.write(" * @file\n")
-            f.write(" * @ingroup python\n")
-            f.write(" */\n\n")
-
-            # Write includes.
-            f.write ("#include <src/common.hpp>\n\n")
-            # for inc in set(exp.includes):
-            #     f.write ("#include \"genesis/" + inc + "\"\n")
-            f.write ("#include \"genesis/genesis.hpp\"\n")
-
-            if exp.using != "":
-                f.write( "\nusing namespace " + exp.using + ";\n" )
-
-            # Write classes.
-            for clss_name, clss_str in exp.class_strings.iteritems():
-                f.write ("\n")
-                # f.write ("void Pybind11Export_" + clss_name + "()\n{")
-                f.write (clss_str)
-                # f.write ("\n}\n\n")
-
-            # Write free functions.
-            if len(exp.function_strings) > 0:
-                identifier = os.path.splitext(filename)[0].replace("/", "_").replace(".", "_") + "_export"
-                f.write("\nPYTHON_EXPORT_FUNCTIONS( " + identifier + ", " + exp.using + ", scope )\n{\n")
-                for func_str in exp.function_strings:
+                print("Warn: File already exists:", fn)
+
+            # Write the parts of the file as they come, instead of assembling the whole content first.
+            # The large buffer collects them, so that the file is still written in few chunks.
+            with open(fn, 'w', encoding='utf-8', buffering=1 << 20) as f:
+
+                # File intro and includes.
+                # for inc in exp.includes:
+                #     f.write ("#include \"genesis/" + inc + "\"\n")
+                f.write (_export_file_intro)
+
+                if exp.using != "":
+                    f.write( "\nusing namespace %s;\n" % exp.using )
+
+                # Classes.
+                for clss_name, clss_str in exp.class_strings.items():
                     f.write ("\n")
                     # f.write ("void Pybind11Export_" + clss_name + "()\n{")
-                    f.write (func_str)
+                    f.write (clss_str)
                     # f.write ("\n}\n\n")
-                f.write("}\n")
-
-            # Write function templates.
-            if len(exp.func_templates) > 0:
-                for tmpl_params, func_str in exp.func_templates.iteritems():
-                    identifier  = os.path.splitext(filename)[0].replace("/", "_").replace(".", "_")
-                    identifier += "_" + tmpl_params.replace("class", "").replace("typename", "").replace(" ", "").replace(",", "_")
-
-                    f.write( "\ntemplate<" + tmpl_params + ">\n" )
-                    f.write( "void python_export_function_" + identifier + " ()\n{\n" )
-                    f.write( "\n".join(func_str) + "}\n" )
-                f.write("\n")
 
-            f.close()
+                # Free functions.
+                if len(exp.function_strings) > 0:
+                    identifier = CppIdentifier(filename) + "_export"
+                    f.write("\nPYTHON_EXPORT_FUNCTIONS( %s, %s, scope )\n{\n" % ( identifier, exp.using ))
+                    for func_str in exp.function_strings:
+                        f.write ("\n")
+                        # f.write ("void Pybind11Export_" + clss_name + "()\n{")
+                        f.write (func_str)
+                        # f.write ("\n}\n\n")
+                    f.write("}\n")
+
+                # Function templates.
+                if len(exp.func_templates) > 0:
+                    for tmpl_params, func_str in exp.func_templates.items():
+                        identifier = CppIdentifier(filename, tmpl_params)
+                        f.write( "\ntemplate<%s>\nvoid python_export_function_%s ()\n{\n%s}\n" % (
+                            tmpl_params, identifier, "\n".join(func_str)
+                        ))
+                    f.write("\n")
 
     # ----------------------------------------------------------------
     #     Generate Files
     # ----------------------------------------------------------------
 
     @staticmethod
-    def generate_files (namespace, directory, module_name):
+    def generate_classes (classes, processes=None):
+        """Generate the bindings of a list of classes, and return them in the same order.
+        The classes are independent of each other, so this is done in parallel if possible,
+        using the given number of processes, or all cores if not set, see ParallelMap()."""
+        return ParallelMap( Pybind11Writer.generate_class, classes, processes )
+
+    @staticmethod
+    def generate_files (namespace, directory, module_name, processes=None):
         # Store a dict of file name -> file content.
-        export_files = {}
+        export_files = defaultdict(ExportFile)
 
-        # Collect exports for all classes.
+        # Select the classes to export, and generate their bindings.
+        classes = []
+        scopes  = []
         for clss in namespace.get_all_classes():
             scope = clss.cpp_full_name().split("::")
             if scope[0] != "" or scope[1] != module_name:
@@ -550,8 +609,12 @@ class Pybind11Writer:
             if len(scope) > 4:
                 # print "Passing scope", scope
                 continue
-            scope = ".".join( scope[ 2 : len(scope)-1 ])
+            classes.append( clss )
+            scopes.append( ".".join( scope[ 2 : len(scope)-1 ]) )
+        clss_bodies = Pybind11Writer.generate_classes( classes, processes )
 
+        # Collect exports for all classes.
+        for clss, scope, clss_body in zip( classes, scopes, clss_bodies ):
             inc_file  = os.path.splitext(clss.location)[0] + ".hpp"
 
             if clss.template_params is None:
@@ -559,34 +622,33 @@ class Pybind11Writer:
             else:
                 clss_file = os.path.splitext(clss.location)[0] + ".hpp"
 
-            if not export_files.has_key(clss_file):
-                export_files[clss_file] = ExportFile()
-                export_files[clss_file].scope = scope
+            exp = export_files[clss_file]
+            if exp.scope is None:
+                exp.scope = scope
 
-            if export_files[clss_file].scope != scope:
-                print "Warn: Multiple scopes in one file:", export_files[clss_file].scope, "and", scope
+            if exp.scope != scope:
+                print("Warn: Multiple scopes in one file:", exp.scope, "and", scope)
 
-            if export_files[clss_file].class_strings.has_key(clss.name):
-                print "Warn. Export file", clss_file, "already has class", clss.name
+            if clss.name in exp.class_strings:
+                print("Warn. Export file", clss_file, "already has class", clss.name)
 
 
             if clss.template_params is None:
-                if export_files[clss_file].using not in [ "", clss.parent.cpp_full_name() ]:
-                    print "Warn: using namespace already set to", export_files[clss_file].using, "instead of", clss.parent.cpp_full_name();
-                export_files[clss_file].using = clss.parent.cpp_full_name()
+                if exp.using not in [ "", clss.parent.cpp_full_name() ]:
+                    print("Warn: using namespace already set to", exp.using, "instead of", clss.parent.cpp_full_name());
+                exp.using = clss.parent.cpp_full_name()
 
                 # clss_str  = "using namespace " + clss.parent.cpp_full_name() + ";\n\n"
-                clss_str  = "PYTHON_EXPORT_CLASS( " + clss.cpp_full_name() + ", scope )\n{\n"
-                clss_str += Pybind11Writer.generate_class(clss)
-                clss_str += "}\n"
+                clss_str = _class_export_template % (
+                    clss.cpp_full_name(), clss_body
+                )
             else:
-                clss_str  = "template <" + ", ".join(clss.template_params) + ">\n"
-                clss_str += "void PythonExportClass_" + clss.cpp_full_name() + "(std::string name)\n{\n"
-                clss_str += Pybind11Writer.generate_class(clss)
-                clss_str += "}\n"
+                clss_str = _class_template_export_template % (
+                    ", ".join(clss.template_params), clss.cpp_full_name(), clss_body
+                )
 
-            export_files[clss_file].includes.append( inc_file )
-            export_files[clss_file].class_strings[clss.name] = clss_str
+            exp.add_include( inc_file )
+            exp.class_strings[clss.name] = clss_str
 
         # Collect exports for all free functions.
         for func in namespace.get_all_functions():
@@ -606,28 +668,26 @@ class Pybind11Writer:
             else:
                 func_file = os.path.splitext(func.location)[0] + ".hpp"
 
-            if not export_files.has_key(func_file):
-                export_files[func_file] = ExportFile()
-                export_files[func_file].scope = scope
+            exp = export_files[func_file]
+            if exp.scope is None:
+                exp.scope = scope
 
-            if export_files[func_file].scope != scope:
-                print "Warn: Multiple scopes in one file:", export_files[func_file].scope, "and", scope
+            if exp.scope != scope:
+                print("Warn: Multiple scopes in one file:", exp.scope, "and", scope)
 
-            if export_files[func_file].using not in [ "", func.parent.cpp_full_name() ]:
-                print "Warn: using namespace already set to", export_files[func_file].using, "instead of", func.parent.cpp_full_name();
+            if exp.using not in [ "", func.parent.cpp_full_name() ]:
+                print("Warn: using namespace already set to", exp.using, "instead of", func.parent.cpp_full_name());
 
-            export_files[func_file].using = func.parent.cpp_full_name()
-            export_files[func_file].includes.append( inc_file )
+            exp.using = func.parent.cpp_full_name()
+            exp.add_include( inc_file )
 
             if func.template_params is None:
                 func_str = Pybind11Writer.generate_function_body(func)
-                export_files[func_file].function_strings.append( func_str )
+                exp.function_strings.append( func_str )
             else:
                 tmpl_params = ", ".join(func.template_params)
                 func_str = Pybind11Writer.generate_function_body(func)
-                if not export_files[func_file].func_templates.has_key(tmpl_params):
-                    export_files[func_file].func_templates[tmpl_params] = []
-                export_files[func_file].func_templates[tmpl_params].append(func_str)
+                exp.func_templates.setdefault(tmpl_params, []).append(func_str)
 
         # Write all files.
         Pybind11Writer.write_export_files( export_files, directory )
@@ -638,10 +698,16 @@ class Pybind11Writer:
     def generate (namespace):
         return Pybind11Writer.generate_namespace (namespace)
 
-# ==================================================================================================
-#     Main
-# ==================================================================================================
-
-if __name__ == "__main__":
-    print "This has no main function."
-    sys.exit()
+    @staticmethod
+    def write (namespace, stream, batch_size = 256):
+        """Write the bindings of a namespace to a stream (e.g., sys.stdout). The chunks are
+        collected into batches, so that there is one write call per batch instead of per chunk,
+        while still not holding the whole output in memory at once."""
+        batch = []
+        for chunk in Pybind11Writer.iter_namespace (namespace):
+            batch.append(chunk)
+            if len(batch) >= batch_size:
+                stream.write("".join(batch))
+                batch = []
+        if len(batch) > 0:
+            stream.write("".join(batch))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Genesis - A toolkit for working with phylogenetic data.
+# Copyright (C) 2014-2018 Lucas Czech and HITS gGmbH
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+# Contact:
+# Lucas Czech <lucas.czech@h-its.org>
+# Exelixis Lab, Heidelberg Institute for Theoretical Studies
+# Schloss-Wolfsbrunnenweg 35, D-69118 Heidelberg, Germany
+
+# Helpers that are shared by the BoostPythonWriter and the Pybind11Writer, and, for the parallel
+# processing, also by the DoxygenReader.
+
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+
+# ==================================================================================================
+#     Helper Functions
+# ==================================================================================================
+
+# Cache for CamelCaseToUnderscore(), as the same names show up over and over again
+# in the classes and functions that we process.
+_camel_case_cache = {}
+
+def CamelCaseToUnderscore(name):
+    # Most names are already lower case, so there is nothing to convert.
+    if name.islower():
+        return name
+    if name in _camel_case_cache:
+        return _camel_case_cache[name]
+
+    # Single scan over the name instead of two regex substitutions. An underscore is put in front
+    # of each capital letter that either follows a lower case letter or a digit ("fooBar", "foo1Bar"),
+    # or that starts a new capitalized word ("Response" in "HTTPResponse").
+    res  = []
+    last = len(name) - 1
+    prev = ""
+    for i, c in enumerate(name):
+        if "A" <= c <= "Z" and i > 0 and (
+            "a" <= prev <= "z" or "0" <= prev <= "9" or ( i < last and "a" <= name[i+1] <= "z" )
+        ):
+            res.append("_")
+        res.append(c)
+        prev = c
+
+    val = "".join(res).lower()
+    _camel_case_cache[name] = val
+    return val
+
+# Translation table for CppEscapeString(), so that all characters are escaped in one pass.
+_cpp_escape_table = str.maketrans({ "\\": "\\\\", "\"": "\\\"", "\n": "\\n" })
+
+def CppEscapeString(txt):
+    return txt.translate(_cpp_escape_table)
+
+# Translation tables for CppIdentifier(), which turn the characters that are not allowed
+# in C++ identifiers into underscores, or drop them, in one pass.
+_file_identifier_table = str.maketrans({ "/": "_", ".": "_" })
+_tmpl_identifier_table = str.maketrans({ " ": None, ",": "_" })
+
+def CppIdentifier(filename, tmpl_params = None):
+    """Return an identifier for the exports of a file, based on its name without extension,
+    and, for function templates, on their template parameters."""
+    val = os.path.splitext(filename)[0].translate(_file_identifier_table)
+    if tmpl_params is not None:
+        tmpl = tmpl_params.replace("class", "").replace("typename", "")
+        val += "_" + tmpl.translate(_tmpl_identifier_table)
+    return val
+
+# Cache for SectionHeader(). There are only a few different kinds of section headers, which only
+# differ in their titles, so we keep their indented rule lines around instead of building them
+# again for every class and namespace.
+_section_rule_cache = {}
+
+def SectionHeader(symbol, title, indent = 0, length = 80):
+    """Return a comment block with the given title between two rules of the symbol."""
+    key = ( symbol, indent, length )
+    if key not in _section_rule_cache:
+        ind = " " * indent
+        _section_rule_cache[key] = (
+            "\n%s// %s\n%s//     " % ( ind, symbol * (length-3), ind ),
+            "\n%s// %s\n\n"       % ( ind, symbol * (length-3) )
+        )
+    head, tail = _section_rule_cache[key]
+    return head + title + tail
+
+# Kind of each C++ operator symbol that we know of, as used by ClassifyOperator().
+OPERATOR_KINDS = dict(
+    ( symbol, kind ) for kind, symbols in [
+        ( "inplace",     [ "+=", "-=", "*=", "/=", "%=", ">>=", "<<=", "&=", "^=", "|=" ] ),
+        ( "comparison",  [ "==", "!=", "<", ">", "<=", ">=" ] ),
+        ( "unary",       [ "-", "+", "~", "!" ] ),
+        ( "array",       [ "[]" ] ),
+        ( "access",      [ "()" ] ),
+        ( "ostream",     [ "<<" ] ),
+        ( "dereference", [ "*", "->" ] ),
+        ( "crement",     [ "++", "--" ] ),
+        ( "assignment",  [ "=" ] ),
+        ( "conversion",  [ "bool" ] )
+    ] for symbol in symbols
+)
+
+# Cache for ClassifyOperator(), as many classes have operators of the same name.
+_operator_class_cache = {}
+
+def ClassifyOperator(name):
+    """Return a tuple (symbol, kind) for the name of an operator function, e.g., ("==", "comparison")
+    for "operator==", or None if the name is not an operator of a known kind."""
+    if name in _operator_class_cache:
+        return _operator_class_cache[name]
+
+    res = None
+    if name.startswith("operator"):
+        symbol = name[len("operator"):].strip()
+        kind   = OPERATOR_KINDS.get(symbol)
+        if kind is not None:
+            res = (symbol, kind)
+
+    _operator_class_cache[name] = res
+    return res
+
+# ==================================================================================================
+#     Parallel Map
+# ==================================================================================================
+
+# Function and items of the running ParallelMap(). The workers are forked, so that they inherit
+# them. Then, only indices and the results need to be sent between the processes, instead of the
+# items, which might be linked to a whole namespace tree.
+_worker_func  = None
+_worker_items = []
+
+def _run_worker(index):
+    # Collect what the function prints (e.g., warnings), so that the parent can print it
+    # in the order of the items, instead of in the order in which the workers get to it.
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        res = _worker_func(_worker_items[index])
+    return res, out.getvalue()
+
+def ParallelMap(func, items, processes = None, chunksize = 16):
+    """Apply a function to each of a list of items, and return the results in the same order.
+    If the platform can fork worker processes, this is done in parallel, using the given number
+    of processes, or all cores if not set. Otherwise, or if there is not enough to do for that to
+    pay off, the items are processed serially."""
+    global _worker_func, _worker_items
+    try:
+        context = multiprocessing.get_context("fork")
+    except ValueError:
+        context = None
+    if context is None or processes == 1 or len(items) < 2:
+        return [ func(item) for item in items ]
+
+    # Flush first, so that pending output is not duplicated by the forked workers.
+    sys.stdout.flush()
+    _worker_func  = func
+    _worker_items = items
+    pool = context.Pool(processes)
+    try:
+        res = []
+        for val, out in pool.imap( _run_worker, range(len(items)), chunksize ):
+            sys.stdout.write(out)
+            res.append(val)
+        return res
+    finally:
+        pool.close()
+        pool.join()
+        _worker_func  = None
+        _worker_items = []
+
+# ==================================================================================================
+#     Export File
+# ==================================================================================================
+
+# Helper struct that collects all the information that goes into one file.
+class ExportFile:
+    # There is one of those per export file, so we save the per-instance dict.
+    __slots__ = (
+        "scope", "using", "class_strings", "function_strings", "func_templates", "includes"
+    )
+
+    def __init__ (self):
+        self.scope            = None
+        self.using            = ""
+        self.class_strings    = {}
+        self.function_strings = []
+        self.func_templates   = {}
+
+        # The includes are the keys of a dict, which serves as an ordered set:
+        # each one is only added once, in the order of first use.
+        self.includes         = {}
+
+    def add_include (self, inc):
+        self.includes[inc] = None